@@ -7,6 +7,8 @@ from flask_mail import Mail
 from flask_babel import Babel, lazy_gettext
 from config import basedir
 from .momentjs import momentjs
+from .ratelimit import Limiter
+from .pubsub import Broker
 
 
 app = Flask(__name__)
@@ -33,6 +35,12 @@ app.jinja_env.globals['momentjs'] = momentjs
 # I18n
 babel = Babel(app)
 
+# 限流与过载保护
+limiter = Limiter(app)
+
+# 新 blog 通知
+broker = Broker(keep=app.config['STREAM_MAX_AGE'])
+
 from app import views, models
 
 # if not app.debug:
@@ -0,0 +1,76 @@
+from bisect import bisect_left, insort
+from threading import Lock
+
+
+def normalize(nickname):
+    # 用于索引和查找的 nickname：去掉首尾空白并忽略大小写
+    return nickname.strip().casefold()
+
+
+class NicknameIndex(object):
+    '''
+    内存中按 normalize 后的 nickname 排序的数组，用 bisect 做前缀查找。
+    第一次使用时通过 loader 从数据库加载，之后在注册和修改 nickname 时由视图函数更新。
+    每个进程各自维护一份。
+    '''
+    def __init__(self, loader):
+        self.loader = loader    # 返回所有 nickname 的可迭代对象
+        self.keys = []
+        self.nicknames = {}     # key -> 原始 nickname
+        self.loaded = False
+        self.lock = Lock()
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.nicknames = dict((normalize(nickname), nickname) for nickname in self.loader())
+            self.keys = sorted(self.nicknames)
+            self.loaded = True
+
+    def clear(self):
+        with self.lock:
+            self.keys = []
+            self.nicknames = {}
+            self.loaded = False
+
+    def add(self, nickname):
+        # 尚未加载时不需要更新，加载时会从数据库读到
+        with self.lock:
+            if not self.loaded:
+                return
+            key = normalize(nickname)
+            if key not in self.nicknames:
+                insort(self.keys, key)
+            self.nicknames[key] = nickname
+
+    def remove(self, nickname):
+        with self.lock:
+            if not self.loaded:
+                return
+            key = normalize(nickname)
+            if self.nicknames.pop(key, None) is not None:
+                del self.keys[bisect_left(self.keys, key)]
+
+    def rename(self, old_nickname, new_nickname):
+        self.remove(old_nickname)
+        self.add(new_nickname)
+
+    def complete(self, prefix, limit=10):
+        '''
+        返回以 prefix 开头（忽略大小写）的至多 limit 个 nickname，按字母序排列。
+        '''
+        self.load()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        with self.lock:
+            i = bisect_left(self.keys, prefix)
+            while i < len(self.keys) and len(results) < limit:
+                key = self.keys[i]
+                if not key.startswith(prefix):
+                    break
+                results.append(self.nicknames[key])
+                i += 1
+        return results
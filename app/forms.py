@@ -2,6 +2,7 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, BooleanField, TextAreaField
 from wtforms.validators import DataRequired, Length
 from .models import User
+from .directory import normalize
 
 class LoginForm(FlaskForm):
     openid = StringField('openid', validators=[DataRequired()])
@@ -20,7 +21,10 @@ class EditForm(FlaskForm):
             return False
         if self.nickname.data == self.original_nickname:
             return True
-        user = User.query.filter_by(nickname=self.nickname.data).first()
+        # 只修改大小写时，按 nickname_key 会查到自己
+        if normalize(self.nickname.data) == normalize(self.original_nickname):
+            return True
+        user = User.find_by_nickname(self.nickname.data)
         if user != None:
             self.nickname.errors.append('This nickname is already in use. Please choose another one.')
             return False
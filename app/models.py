@@ -1,5 +1,7 @@
 from datetime import datetime
 from app import db
+from .directory import normalize, NicknameIndex
+from .tags import extract_tags, Trending
 
 
 # 辅助表
@@ -10,6 +12,7 @@ followers = db.Table('followers',
 class User(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     nickname = db.Column(db.String(64), index = True, unique = True)
+    nickname_key = db.Column(db.String(64), index = True, unique = True)   # 忽略大小写的 nickname，用于查找和判断是否重复
     email = db.Column(db.String(120), index = True, unique = True)
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime)
@@ -35,18 +38,58 @@ class User(db.Model):
         size = str(size)
         return 'https://unsplash.it/'+size+'/'+size+'/?random'
 
+    @db.validates('nickname')
+    def validate_nickname(self, key, nickname):
+        # 修改 nickname 时同步更新 nickname_key
+        self.nickname_key = normalize(nickname)
+        return nickname
+
+    @staticmethod
+    def find_by_nickname(nickname):
+        # 忽略大小写，按 nickname_key 索引查找用户
+        return User.query.filter_by(nickname_key=normalize(nickname)).first()
+
+    @staticmethod
+    def backfill_nickname_keys():
+        '''
+        为加入 nickname_key 之前创建的数据库补上该列：
+        缺少时添加列，按 normalize(nickname) 填充，再建立唯一索引。
+        只有大小写不同的 nickname 只给 id 最小的用户填充，其余保持为空，
+        返回这些冲突的 nickname 列表，如 [['john', 'John']]，需要手动改名后再次执行。
+        '''
+        columns = [column['name'] for column in db.inspect(db.engine).get_columns('user')]
+        if 'nickname_key' not in columns:
+            db.session.execute(db.text('ALTER TABLE "user" ADD COLUMN nickname_key VARCHAR(64)'))
+        # 只查询 id 和 nickname，即使其他列还没有准备好也可以执行
+        groups = {}
+        for id, nickname in db.session.query(User.id, User.nickname).order_by(User.id):
+            groups.setdefault(normalize(nickname), []).append((id, nickname))
+        conflicts = []
+        for key, users in groups.items():
+            db.session.query(User).filter(User.id == users[0][0]).update({'nickname_key': key}, synchronize_session=False)
+            if len(users) > 1:
+                db.session.query(User).filter(User.id.in_([id for id, nickname in users[1:]])).update({'nickname_key': None}, synchronize_session=False)
+                conflicts.append([nickname for id, nickname in users])
+        db.session.execute(db.text('CREATE UNIQUE INDEX IF NOT EXISTS ix_user_nickname_key ON "user" (nickname_key)'))
+        db.session.commit()
+        return conflicts
+
     @staticmethod
     def make_unique_nickname(nickname):
         # 使用OpenID回调，创建用户时验证nickname是否已存在
-        if User.query.filter_by(nickname=nickname).first() == None:
+        # 用一次范围查询取出 nickname 本身和以 nickname 加数字开头的 nickname_key（':' 是 '9' 的下一个字符），
+        # 再找出最小的未被使用的数字后缀
+        nickname = nickname.strip()
+        key = normalize(nickname)
+        taken = set(row[0] for row in db.session.query(User.nickname_key).filter(
+            db.or_(User.nickname_key == key,
+                db.and_(User.nickname_key >= key + '0', User.nickname_key < key + ':'))))
+        if key not in taken:
             return nickname
         version = 2
-        while True:
-            new_nickname = nickname + str(version)
-            if User.query.filter_by(nickname=nickname).first() == None:
-                break
+        while key + str(version) in taken:
             version += 1
-        return new_nickname
+        return nickname + str(version)
 
     def follow(self, user):
         # 关注某用户
@@ -68,6 +111,10 @@ class User(db.Model):
         # 登录用户所有关注者撰写的 blog ,按时间排序。
         return Post.query.join(followers, (followers.c.followed_id == Post.user_id)).filter(followers.c.follower_id == self.id).order_by(Post.timestamp.desc())
 
+    def follower_ids(self):
+        # 所有关注者的 id，只查辅助表，用于推送新 blog
+        return [row[0] for row in db.session.query(followers.c.follower_id).filter(followers.c.followed_id == self.id)]
+
     # Flask-Login 扩展需要在我们的 User 类中实现一些特定的方法。
     def is_authenticated(self):
         '''
@@ -93,6 +140,10 @@ class User(db.Model):
         '''
         return str(self.id)
 
+# 用于 nickname 自动补全的内存索引
+directory = NicknameIndex(lambda: (row[0] for row in db.session.query(User.nickname)))
+
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     body = db.Column(db.String(140))
@@ -109,11 +160,62 @@ class Post(db.Model):
             timestamp = datetime.utcnow()
         self.timestamp = timestamp
         self.user = user
+        # 发表时提取话题和提及，随 blog 一起保存
+        for name in extract_tags(body):
+            Tag(name, self)
 
     def __repr__(self):
         return '<Post %r>' % (self.body)
 
 
+class Tag(db.Model):
+    '''
+    blog 中的 #话题 和 @提及，name 带前缀，如 '#python'、'@john'
+    '''
+    id = db.Column(db.Integer, primary_key = True)
+    name = db.Column(db.String(64))
+    timestamp = db.Column(db.DateTime, index = True)
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    post = db.relationship('Post',
+        backref=db.backref('tags', lazy='dynamic'))
+
+    # 按话题分页显示 blog 时使用
+    __table_args__ = (db.Index('ix_tag_name_post_id', 'name', 'post_id'),)
+
+    def __init__(self, name, post):
+        self.name = name
+        self.timestamp = post.timestamp
+        self.post = post
+
+    def __repr__(self):
+        return '<Tag %r>' % (self.name)
+
+    @staticmethod
+    def backfill(batch_size=1000):
+        '''
+        为加入 tag 表之前发表的 blog 提取话题和提及，返回处理的 blog 数
+        已经有 tag 的 blog 会被跳过，可以重复执行
+        '''
+        tagged = db.session.query(Tag.post_id)
+        count = 0
+        last_id = 0
+        while True:
+            posts = Post.query.filter(Post.id > last_id, ~Post.id.in_(tagged)).order_by(Post.id).limit(batch_size).all()
+            if not posts:
+                return count
+            for post in posts:
+                for name in extract_tags(post.body):
+                    Tag(name, post)
+            db.session.commit()
+            count += len(posts)
+            last_id = posts[-1].id
+
+
+# 热门话题和提及
+trending = Trending(lambda since: db.session.query(Tag.name, Tag.timestamp).filter(Tag.timestamp >= since).order_by(Tag.timestamp))
+
+
 '''
 >>> py = User('Python', 'abc@asdf.com')
 >>> p = Post('Hello Python!', py)
@@ -0,0 +1,78 @@
+import time
+from queue import Queue, Empty, Full
+from threading import Lock
+
+
+class Broker(object):
+    '''
+    进程内的发布/订阅，按关注者的用户 id 分发新 blog 的 id。
+    多进程部署时各进程的订阅者互不可见，可以换成共享的消息服务（如 Redis pub/sub），
+    只需实现同样的 publish 和 listen 方法；客户端重连时会带上已收到的最新 id 补齐遗漏。
+    '''
+    def __init__(self, maxsize=16, keep=300):
+        self.maxsize = maxsize
+        self.keep = keep        # latest 中的记录保留的秒数，应不小于客户端重连的间隔
+        self.subscribers = {}   # user_id -> set(Queue)
+        self.latest = {}        # user_id -> (最近一次发布给该用户的 post id, 发布时间)
+        self.last_prune = 0
+        self.lock = Lock()
+
+    def subscribe(self, user_id):
+        q = Queue(self.maxsize)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self.lock:
+            queues = self.subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(q)
+                if not queues:
+                    del self.subscribers[user_id]
+
+    def prune(self, now):
+        # 删除过期的 latest 记录，避免随用户数不断增长
+        for user_id, (post_id, published) in list(self.latest.items()):
+            if now - published > self.keep:
+                del self.latest[user_id]
+        self.last_prune = now
+
+    def publish(self, user_ids, post_id, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if now - self.last_prune > self.keep:
+                self.prune(now)
+            for user_id in user_ids:
+                latest = self.latest.get(user_id, (0, now))[0]
+                self.latest[user_id] = (max(post_id, latest), now)
+                for q in self.subscribers.get(user_id, ()):
+                    try:
+                        q.put_nowait(post_id)
+                    except Full:
+                        # 客户端只需要知道有新 blog，丢掉的 id 会在拉取增量时补上
+                        pass
+
+    def listen(self, user_id, since, heartbeat, max_age):
+        '''
+        生成器，有新 blog 时产生其 id，每 heartbeat 秒没有消息时产生 None 作为心跳，
+        max_age 秒后结束，由客户端重新连接。
+        '''
+        q = self.subscribe(user_id)
+        try:
+            with self.lock:
+                latest, published = self.latest.get(user_id, (0, 0))
+            if latest > since and time.time() - published <= self.keep:
+                yield latest
+            deadline = time.time() + max_age
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                try:
+                    yield q.get(timeout=min(heartbeat, remaining))
+                except Empty:
+                    yield None
+        finally:
+            self.unsubscribe(user_id, q)
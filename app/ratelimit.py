@@ -0,0 +1,166 @@
+import math
+import time
+from functools import wraps
+from threading import Lock
+from flask import g, request, render_template
+
+
+class MemoryStore(object):
+    '''
+    进程内的令牌桶存储，key -> (剩余令牌数, 上次补充时间, 每秒补充令牌数, 桶容量)
+    已补满的桶和不存在的桶等价，定期清理以免占用的内存不断增长。
+    多进程部署时可以换成共享存储（如 Redis），只需实现同样的 consume 方法。
+    '''
+    def __init__(self, sweep_interval=60):
+        self.buckets = {}
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0
+        self.lock = Lock()
+
+    def _tokens(self, key, rate, capacity, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return capacity
+        tokens, last = bucket[:2]
+        return min(capacity, tokens + (now - last) * rate)
+
+    def sweep(self, now):
+        for key, (tokens, last, rate, capacity) in list(self.buckets.items()):
+            if tokens + (now - last) * rate >= capacity:
+                del self.buckets[key]
+        self.last_sweep = now
+
+    def consume(self, limits, now=None):
+        '''
+        limits 为 [(key, 每秒补充令牌数, 桶容量), ...]，
+        所有桶都有令牌时才从每个桶各取一个并返回 0，否则不取令牌，返回需要等待的秒数。
+        '''
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if now - self.last_sweep > self.sweep_interval:
+                self.sweep(now)
+            levels = [self._tokens(key, rate, capacity, now) for key, rate, capacity in limits]
+            wait = 0
+            for (key, rate, capacity), tokens in zip(limits, levels):
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if wait:
+                return wait
+            for (key, rate, capacity), tokens in zip(limits, levels):
+                self.buckets[key] = (tokens - 1, now, rate, capacity)
+            return 0
+
+
+class LoadMonitor(object):
+    '''
+    记录正在处理的请求数，以及最近请求的数据库耗时（指数移动平均）。
+    '''
+    def __init__(self, alpha=0.2, window=10):
+        self.alpha = alpha
+        self.window = window    # 超过 window 秒没有新的采样，认为数据库耗时已恢复
+        self.inflight = 0
+        self.db_latency = 0.0
+        self.last_sample = 0
+        self.lock = Lock()
+
+    def enter(self):
+        with self.lock:
+            self.inflight += 1
+
+    def leave(self):
+        with self.lock:
+            self.inflight = max(0, self.inflight - 1)
+
+    def record(self, duration, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if now - self.last_sample > self.window:
+                self.db_latency = duration
+            else:
+                self.db_latency += self.alpha * (duration - self.db_latency)
+            self.last_sample = now
+
+    def latency(self, now=None):
+        if now is None:
+            now = time.time()
+        if now - self.last_sample > self.window:
+            return 0.0
+        return self.db_latency
+
+
+class Limiter(object):
+    '''
+    按用户、按接口类别的令牌桶限流，以及按排队请求数和数据库耗时的过载保护。
+    配置见 config.py 中的 RATELIMIT_* 。
+    '''
+    def __init__(self, app=None, store=None):
+        self.store = store or MemoryStore()
+        self.monitor = LoadMonitor()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+        @app.before_request
+        def _enter():
+            self.monitor.enter()
+
+        @app.teardown_request
+        def _leave(exc):
+            self.monitor.leave()
+
+    def record_queries(self, queries):
+        # 由 after_request 调用，和慢查询日志使用同一份 get_debug_queries 数据
+        duration = sum(query.duration for query in queries)
+        if duration:
+            self.monitor.record(duration)
+
+    def overloaded(self):
+        config = self.app.config
+        if self.monitor.inflight > config['RATELIMIT_MAX_INFLIGHT']:
+            return True
+        return self.monitor.latency() > config['RATELIMIT_MAX_DB_LATENCY']
+
+    def check(self, endpoint_class, key):
+        '''
+        返回 (状态码, 需要等待的秒数)，状态码为 None 表示放行。
+        '''
+        config = self.app.config
+        if not config['RATELIMIT_ENABLED']:
+            return None, 0
+        if self.overloaded():
+            return 503, config['RATELIMIT_RETRY_AFTER']
+        limits = config['RATELIMITS'][endpoint_class]
+        # 用户的桶和全局的桶都有令牌时才放行，被拒绝的请求不消耗任何一个桶的令牌
+        wait = self.store.consume([
+            ('%s:%s' % (endpoint_class, key),) + tuple(limits['user']),
+            (endpoint_class,) + tuple(limits['global'])])
+        if wait:
+            return 429, wait
+        return None, 0
+
+    def limit(self, endpoint_class, methods=None):
+        '''
+        视图装饰器，放在 login_required 之后使用，这样可以按 g.user 限流。
+        methods 为 None 时限制所有请求方法，否则只限制给出的方法（如只限制 POST）。
+        '''
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    user = getattr(g, 'user', None)
+                    if user is not None and user.is_authenticated:
+                        key = user.get_id()
+                    else:
+                        key = request.remote_addr
+                    status, wait = self.check(endpoint_class, key)
+                    if status is not None:
+                        template = '%d.html' % status
+                        return render_template(template), status, {'Retry-After': str(int(math.ceil(wait)))}
+                return f(*args, **kwargs)
+            return wrapper
+        return decorator
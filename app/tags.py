@@ -0,0 +1,138 @@
+import re
+import time
+import calendar
+from collections import deque, Counter
+from heapq import heappush, heappop, heapify
+from threading import Lock
+from datetime import datetime
+from .directory import normalize
+
+
+# #话题 和 @用户，前面不能紧跟字母数字（排除邮箱地址）
+TAG_RE = re.compile(r'(?<![\w#@])([#@])(\w+)', re.UNICODE)
+
+
+def extract_tags(body):
+    '''
+    从 blog 内容中提取话题和提及，返回去重后的名字列表，如 ['#python', '@john']
+    '''
+    names = []
+    for sigil, word in TAG_RE.findall(body or ''):
+        name = sigil + normalize(word)[:63]
+        if name not in names:
+            names.append(name)
+    return names
+
+
+class SlidingWindow(object):
+    '''
+    最近 length 秒内每个名字的出现次数，按 bucket 秒分桶，过期时整桶减去。
+    heap 中保存 (-次数, 名字)，计数变化时压入新条目，旧条目在查询时丢弃。
+    '''
+    def __init__(self, length, bucket):
+        self.length = length
+        self.bucket = bucket
+        self.buckets = deque()  # (桶的开始时间, Counter)
+        self.counts = {}
+        self.heap = []
+
+    def _set(self, name, count):
+        if count > 0:
+            self.counts[name] = count
+            heappush(self.heap, (-count, name))
+        else:
+            self.counts.pop(name, None)
+
+    def add(self, name, now):
+        # 时间需要按顺序给出，早于最后一个桶的记入最后一个桶
+        start = now - now % self.bucket
+        if start <= now - self.length:
+            return
+        if not self.buckets or self.buckets[-1][0] < start:
+            self.buckets.append((start, Counter()))
+        self.buckets[-1][1][name] += 1
+        self._set(name, self.counts.get(name, 0) + 1)
+
+    def expire(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.length:
+            start, counter = self.buckets.popleft()
+            for name, count in counter.items():
+                self._set(name, self.counts.get(name, 0) - count)
+        # 过期条目太多时重建 heap
+        if len(self.heap) > 2 * len(self.counts) + 64:
+            self.heap = [(-count, name) for name, count in self.counts.items()]
+            heapify(self.heap)
+
+    def top(self, k, now):
+        self.expire(now)
+        result = []
+        valid = []
+        while self.heap and len(result) < k:
+            entry = heappop(self.heap)
+            count, name = -entry[0], entry[1]
+            if self.counts.get(name) != count or (name, count) in result:
+                continue
+            result.append((name, count))
+            valid.append(entry)
+        for entry in valid:
+            heappush(self.heap, entry)
+        return result
+
+
+class Trending(object):
+    '''
+    热门话题和提及，每个时间窗口一个 SlidingWindow。
+    第一次使用时通过 loader(since) 从 tag 表加载最长窗口内的数据，之后在发表 blog 时更新。
+    每个进程各自维护一份。
+    '''
+    WINDOWS = {
+        'hour': (3600, 60),
+        'day': (86400, 3600),
+    }
+
+    def __init__(self, loader):
+        self.loader = loader    # 返回 since 之后按时间排序的 (name, timestamp) 列表
+        self.windows = {}
+        self.loaded = False
+        self.lock = Lock()
+
+    def load(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.loaded:
+                return
+            self.windows = dict((key, SlidingWindow(length, bucket)) for key, (length, bucket) in self.WINDOWS.items())
+            length = max(length for length, bucket in self.WINDOWS.values())
+            for name, timestamp in self.loader(datetime.utcfromtimestamp(now - length)):
+                self._add(name, calendar.timegm(timestamp.utctimetuple()))
+            self.loaded = True
+
+    def clear(self):
+        with self.lock:
+            self.windows = {}
+            self.loaded = False
+
+    def _add(self, name, now):
+        for window in self.windows.values():
+            window.add(name, now)
+
+    def add(self, names, now=None):
+        # 尚未加载时不需要更新，加载时会从数据库读到
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.loaded:
+                return
+            for name in names:
+                self._add(name, now)
+
+    def top(self, window, k=10, now=None):
+        '''
+        返回时间窗口 window（'hour' 或 'day'）内出现次数最多的 k 个 (名字, 次数)
+        '''
+        if now is None:
+            now = time.time()
+        self.load(now)
+        with self.lock:
+            return self.windows[window].top(k, now)
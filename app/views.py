@@ -1,12 +1,13 @@
 from datetime import datetime
-from flask import render_template, flash, redirect, session, url_for, request, g
+from flask import render_template, flash, redirect, session, url_for, request, g, jsonify, Response
 from flask_login import login_user, logout_user, current_user, login_required
 from flask_babel import gettext
 from flask_sqlalchemy import get_debug_queries
-from app import app, db, lm, oid, babel
+from app import app, db, lm, oid, babel, limiter, broker
 from .forms import LoginForm, EditForm, PostForm, SearchForm
-from .models import User, Post
-from config import POSTS_PER_PAGE, LANGUAGES, DATABASE_QUERY_TIMEOUT
+from .models import User, Post, Tag, directory, trending
+from .directory import normalize
+from config import POSTS_PER_PAGE, LANGUAGES, DATABASE_QUERY_TIMEOUT, STREAM_HEARTBEAT, STREAM_MAX_AGE, TRENDING_SIZE
 from .emails import follower_notification
 
 
@@ -23,9 +24,11 @@ def before_request():
 
 @app.after_request
 def after_request(response):
-    for query in get_debug_queries():
+    queries = get_debug_queries()
+    for query in queries:
         if query.duration >= DATABASE_QUERY_TIMEOUT:
             app.logger.warning("SLOW QUERY: %s\nParameters: %s\nDuration: %s\nContext: %s\n" % (query.statement, query.parameters, query.duration, query.context))
+    limiter.record_queries(queries)
     return response
 
 @app.errorhandler(404)
@@ -59,6 +62,7 @@ def get_locale():
 @app.route('/index', methods=['GET', 'POST'])
 @app.route('/index/<int:page>', methods=['GET', 'POST'])
 @login_required
+@limiter.limit('post', methods=['POST'])
 def index(page=1):
     '''
     首页
@@ -69,6 +73,8 @@ def index(page=1):
         post = Post(body=form.post.data, user=g.user)
         db.session.add(post)
         db.session.commit()
+        broker.publish(g.user.follower_ids(), post.id)
+        trending.add([tag.name for tag in post.tags])
         flash(gettext('Your post is now live!'))
         return redirect(url_for('index'))   # 避免用户在提交 blog 后不小心触发刷新的动作而导致插入重复的 blog
     # Get method
@@ -93,12 +99,48 @@ def index(page=1):
         posts = posts)
 
 
+@app.route('/posts/stream')
+@login_required
+def posts_stream():
+    '''
+    用 Server-Sent Events 通知有新 blog，只发送 post id，内容由客户端通过 posts_new 拉取
+    since 为客户端已有的最新 post id
+    '''
+    user_id = g.user.id
+    since = request.args.get('since', 0, type=int)
+    def events():
+        for post_id in broker.listen(user_id, since, STREAM_HEARTBEAT, STREAM_MAX_AGE):
+            if post_id is None:
+                yield ': keepalive\n\n'
+            else:
+                yield 'data: %d\n\n' % post_id
+    return Response(events(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/posts/new')
+@login_required
+def posts_new():
+    '''
+    返回关注的用户在 since 之后发表的 blog，最新的在前
+    '''
+    since = request.args.get('since', 0, type=int)
+    posts = g.user.followed_posts().filter(Post.id > since).order_by(None).order_by(Post.id.desc()).limit(POSTS_PER_PAGE * 10)
+    return jsonify(posts=[{
+        'id': post.id,
+        'body': post.body,
+        'nickname': post.user.nickname,
+        'avatar': post.user.avatar(70),
+        'url': url_for('user', nickname=post.user.nickname),
+        'timestamp': post.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')} for post in posts])
+
+
 @app.route('/login/<nickname>', methods=['GET'])
 def login_test(nickname):
     '''
     用于测试
     '''
-    user = User.query.filter_by(nickname=nickname).first()
+    user = User.find_by_nickname(nickname)
     if not user:
         flash(gettext('Error'))
         return redirect(url_for('login'))
@@ -156,6 +198,7 @@ def after_login(resp):
         user = User(nickname=nickname, email=resp.email)
         db.session.add(user)
         db.session.commit()
+        directory.add(user.nickname)
         # make the user follow him/herself
         db.session.add(user.follow(user))
         db.session.commit()
@@ -185,7 +228,7 @@ def user(nickname, page=1):
     用户详情页
     需要登录
     '''
-    user = User.query.filter_by(nickname=nickname).first()
+    user = User.find_by_nickname(nickname)
     if user == None:
         flash(gettext('User' + nickname + ' not found.'))
         return redirect(url_for('index'))
@@ -195,18 +238,30 @@ def user(nickname, page=1):
         posts = posts)
 
 
+@app.route('/users/autocomplete')
+@login_required
+def users_autocomplete():
+    '''
+    nickname 自动补全，q 为输入的前缀
+    '''
+    return jsonify(users=directory.complete(request.args.get('q', '')))
+
+
 @app.route('/edit', methods=['GET', 'POST'])
 @login_required
+@limiter.limit('edit', methods=['POST'])
 def edit():
     '''
     编辑用户信息
     '''
     form = EditForm(g.user.nickname)
     if form.validate_on_submit():
+        old_nickname = g.user.nickname
         g.user.nickname = form.nickname.data
         g.user.about_me = form.about_me.data
         db.session.add(g.user)
         db.session.commit()
+        directory.rename(old_nickname, g.user.nickname)
         flash(gettext('Your changes have been saved.'))
         return redirect(url_for('edit'))
     else:
@@ -217,11 +272,12 @@ def edit():
 
 @app.route('/follow/<nickname>')
 @login_required
+@limiter.limit('follow')
 def follow(nickname):
     '''
     关注某用户
     '''
-    user = User.query.filter_by(nickname=nickname).first()
+    user = User.find_by_nickname(nickname)
     if user is None:
         flash(gettext('User %s not found.' % nickname))
         return redirect(url_for('index'))
@@ -245,7 +301,7 @@ def unfollow(nickname):
     '''
     取消关注
     '''
-    user = User.query.filter_by(nickname=nickname).first()
+    user = User.find_by_nickname(nickname)
     if user is None:
         flash(gettext('User %s not found.' % nickname))
         return redirect(url_for('index'))
@@ -272,9 +328,38 @@ def search():
 
 @app.route('/search_results/<query>')
 @login_required
+@limiter.limit('search')
 def search_results(query):
     # ToDo
     results = Post.query.filter(Post.body.like('%'+query+'%'))
     return render_template('search_results.html',
         query = query,
         results = results)
+
+
+@app.route('/trending')
+@login_required
+def trending_tags():
+    '''
+    最近一小时和一天内的热门话题和提及，只读内存中的计数，不查询 blog 表
+    '''
+    return render_template('trending.html',
+        title = 'Trending',
+        hour = trending.top('hour', TRENDING_SIZE),
+        day = trending.top('day', TRENDING_SIZE))
+
+
+@app.route('/tag/<name>')
+@app.route('/tag/<name>/<int:page>')
+@login_required
+def tag(name, page=1):
+    '''
+    某个话题（/tag/python）或提及（/tag/@john）的 blog，按 (name, post_id) 索引分页
+    '''
+    if not name.startswith('@'):
+        name = '#' + name.lstrip('#')
+    key = name[0] + normalize(name[1:])
+    posts = Post.query.join(Tag, Tag.post_id == Post.id).filter(Tag.name == key).order_by(Tag.post_id.desc()).paginate(page, POSTS_PER_PAGE, False)
+    return render_template('tag.html',
+        name = name,
+        posts = posts)
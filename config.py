@@ -31,6 +31,13 @@ ADMINS = ['test@test.com']
 # 分页
 POSTS_PER_PAGE = 3
 
+# 热门话题显示的个数
+TRENDING_SIZE = 10
+
+# 新 blog 推送（Server-Sent Events）：心跳间隔和单个连接的最长时间（秒）
+STREAM_HEARTBEAT = 15
+STREAM_MAX_AGE = 300
+
 # I18n
 LANGUAGES = {
     'en': 'English',
@@ -40,4 +47,17 @@ LANGUAGES = {
 # 启用 Flask-SQLAlchemy 的 get_debug_queries 功能
 SQLALCHEMY_RECORD_QUERIES = True
 
-DATABASE_QUERY_TIMEOUT = 0.5
\ No newline at end of file
+DATABASE_QUERY_TIMEOUT = 0.5
+
+# 限流：每个接口类别分别对单个用户和全局设置 (每秒补充令牌数, 桶容量)
+RATELIMIT_ENABLED = True
+RATELIMITS = {
+    'post': {'user': (0.2, 5), 'global': (20, 50)},
+    'edit': {'user': (0.1, 3), 'global': (10, 20)},
+    'follow': {'user': (0.5, 10), 'global': (20, 50)},
+    'search': {'user': (0.5, 5), 'global': (5, 10)},
+}
+# 过载保护：正在处理的请求数或数据库平均耗时（秒）超过阈值时返回 503
+RATELIMIT_MAX_INFLIGHT = 32
+RATELIMIT_MAX_DB_LATENCY = DATABASE_QUERY_TIMEOUT
+RATELIMIT_RETRY_AFTER = 5
@@ -0,0 +1,11 @@
+"""
+为已有的数据库添加并填充 user.nickname_key
+使用`env\Scripts\python nickname_backfill.py`
+"""
+from app.models import User
+
+
+conflicts = User.backfill_nickname_keys()
+for nicknames in conflicts:
+    print('nickname conflict (rename all but the first): %s' % ', '.join(nicknames))
+print('%d conflicts' % len(conflicts))
@@ -0,0 +1,8 @@
+"""
+为已有的 blog 生成 tag 表中的话题和提及
+使用`env\Scripts\python tag_backfill.py`
+"""
+from app.models import Tag
+
+
+print('%d posts scanned' % Tag.backfill())
@@ -1,9 +1,13 @@
 import os
+import json
 import unittest
 
 from config import basedir
-from app import app, db
-from app.models import User
+from app import app, db, limiter, broker
+from app.models import User, Post, Tag, directory, trending
+from app.ratelimit import MemoryStore, LoadMonitor
+from app.pubsub import Broker
+from app.tags import extract_tags, SlidingWindow
 
 class TestCase(unittest.TestCase):
 
@@ -13,6 +17,11 @@ class TestCase(unittest.TestCase):
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'test.db')
         self.app = app.test_client()
         db.create_all()
+        limiter.store = MemoryStore()
+        limiter.monitor = LoadMonitor()
+        directory.clear()
+        broker.latest.clear()
+        trending.clear()
 
     def tearDown(self):
         db.session.remove()
@@ -36,6 +45,55 @@ class TestCase(unittest.TestCase):
         nickname2 = User.make_unique_nickname('john')
         assert nickname2 != 'john'
         assert nickname2 != nickname
+        assert User.make_unique_nickname('John') == 'John3'
+        assert User.make_unique_nickname('jo') == 'jo'
+        assert User.make_unique_nickname(' john ') == 'john3'
+        db.session.add(User(nickname='johnny', email='johnny@example.com'))
+        db.session.add(User(nickname='a*b', email='ab@example.com'))
+        db.session.add(User(nickname='axb2', email='axb@example.com'))
+        db.session.commit()
+        assert User.make_unique_nickname('john') == 'john3'
+        assert User.make_unique_nickname('a*b') == 'a*b2'
+
+    def test_find_by_nickname(self):
+        u = User(nickname='John', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        assert u.nickname_key == 'john'
+        assert User.find_by_nickname('jOHN') == u
+        u.nickname = 'Johnny'
+        db.session.add(u)
+        db.session.commit()
+        assert User.find_by_nickname('john') == None
+        assert User.find_by_nickname('johnny') == u
+
+    def test_backfill_nickname_keys(self):
+        # 模拟加入 nickname_key 之前创建的数据库
+        db.session.execute(db.text('DROP INDEX ix_user_nickname_key'))
+        db.session.execute(db.text('ALTER TABLE user DROP COLUMN nickname_key'))
+        for nickname in ['john', 'Susan', 'John']:
+            db.session.execute(db.text('INSERT INTO user (nickname, email) VALUES (:nickname, :email)'),
+                {'nickname': nickname, 'email': nickname + '@example.com'})
+        db.session.commit()
+        assert User.backfill_nickname_keys() == [['john', 'John']]
+        assert User.find_by_nickname('SUSAN').nickname == 'Susan'
+        assert User.find_by_nickname('JOHN').nickname == 'john'
+        assert User.backfill_nickname_keys() == [['john', 'John']]
+
+    def test_autocomplete(self):
+        for nickname in ['john', 'Johnny', 'joan', 'susan']:
+            db.session.add(User(nickname=nickname, email=nickname + '@example.com'))
+        db.session.commit()
+        assert directory.complete('jo') == ['joan', 'john', 'Johnny']
+        assert directory.complete('JOHN', limit=1) == ['john']
+        assert directory.complete('') == []
+        directory.add('Johanna')
+        directory.rename('susan', 'josie')
+        assert directory.complete('jo') == ['joan', 'Johanna', 'john', 'Johnny', 'josie']
+        assert directory.complete('s') == []
+        self.app.get('/login/susan')
+        rv = self.app.get('/users/autocomplete?q=joh')
+        assert json.loads(rv.data.decode('utf-8')) == {'users': ['Johanna', 'john', 'Johnny']}
 
     def test_follow(self):
         u1 = User(nickname = 'john', email = 'john@example.com')
@@ -110,5 +168,143 @@ class TestCase(unittest.TestCase):
         assert f3 == [p4, p3]
         assert f4 == [p4]
 
+    def test_token_bucket(self):
+        store = MemoryStore()
+        for i in range(3):
+            assert store.consume([('k', 1, 3)], now=100) == 0
+        assert store.consume([('k', 1, 3)], now=100) == 1
+        assert store.consume([('other', 1, 3)], now=100) == 0
+        assert store.consume([('k', 1, 3)], now=101) == 0
+        assert store.consume([('k', 1, 3)], now=200) == 0
+        # 全局的桶拒绝时不消耗用户的桶
+        assert store.consume([('user', 1, 3), ('global', 1, 1)], now=300) == 0
+        assert store.consume([('user', 1, 3), ('global', 1, 1)], now=300) == 1
+        assert store.buckets['user'][0] == 2
+        # 补满的桶会被清理
+        store.sweep(1000)
+        assert store.buckets == {}
+
+    def test_load_monitor(self):
+        monitor = LoadMonitor(alpha=0.5, window=10)
+        monitor.record(1.0, now=100)
+        monitor.record(0.0, now=101)
+        assert monitor.latency(now=101) == 0.5
+        assert monitor.latency(now=120) == 0.0
+        monitor.enter()
+        monitor.leave()
+        monitor.leave()
+        assert monitor.inflight == 0
+
+    def test_rate_limit(self):
+        u = User(nickname='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.app.get('/login/john')
+        capacity = app.config['RATELIMITS']['search']['user'][1]
+        for i in range(capacity):
+            assert self.app.get('/search_results/post').status_code == 200
+        rv = self.app.get('/search_results/post')
+        assert rv.status_code == 429
+        assert 'Retry-After' in rv.headers
+        limiter.monitor.record(app.config['RATELIMIT_MAX_DB_LATENCY'] * 10)
+        assert self.app.get('/follow/john').status_code == 503
+
+    def test_broker(self):
+        b = Broker()
+        # max_age 取得足够大，只有心跳依赖很短的超时
+        events = b.listen(1, 0, 0.01, 5)
+        assert next(events) == None
+        b.publish([1, 2], 5)
+        assert next(events) == 5
+        assert list(b.listen(2, 0, 0.01, 0)) == [5]
+        assert list(b.listen(2, 5, 0.01, 0)) == []
+        events.close()
+        assert b.subscribers == {}
+        b = Broker(keep=10)
+        b.publish([1], 5, now=100)
+        b.publish([2], 6, now=200)
+        assert list(b.latest) == [2]
+
+    def test_new_posts(self):
+        u1 = User(nickname='john', email='john@example.com')
+        u2 = User(nickname='susan', email='susan@example.com')
+        db.session.add(u1)
+        db.session.add(u2)
+        db.session.commit()
+        db.session.add(u1.follow(u1))
+        db.session.add(u1.follow(u2))
+        db.session.commit()
+        self.app.get('/login/john')
+        assert b'var newest = 0;' in self.app.get('/index').data
+        p1 = Post(body='post from susan', user=u2)
+        db.session.add(p1)
+        db.session.commit()
+        assert u2.follower_ids() == [u1.id]
+        u1_id, u2_id, p1_id = u1.id, u2.id, p1.id
+        self.app.get('/login/susan')
+        self.app.post('/index', data={'post': 'new post from susan'})
+        p2 = Post.query.filter_by(body='new post from susan').first()
+        p2_id = p2.id
+        assert broker.latest[u1_id][0] == p2_id
+        assert broker.latest[u2_id][0] == p2_id
+        self.app.get('/login/john')
+        rv = self.app.get('/posts/stream?since=%d' % p1_id)
+        assert rv.mimetype == 'text/event-stream'
+        assert next(rv.response) == b'data: %d\n\n' % p2_id
+        rv.close()
+        rv = self.app.get('/posts/new?since=%d' % p1_id)
+        posts = json.loads(rv.data.decode('utf-8'))['posts']
+        assert [post['id'] for post in posts] == [p2_id]
+        assert posts[0]['nickname'] == 'susan'
+
+    def test_extract_tags(self):
+        assert extract_tags('Hello #Python and #python, @John! mail me at a@b.com #中文') == ['#python', '@john', '#中文']
+        assert extract_tags('no tags ## @') == []
+
+    def test_sliding_window(self):
+        w = SlidingWindow(100, 10)
+        w.add('a', 0)
+        w.add('b', 55)
+        w.add('b', 56)
+        w.add('c', 95)
+        assert w.top(2, 95) == [('b', 2), ('a', 1)]
+        assert w.top(5, 105) == [('b', 2), ('c', 1)]
+        assert w.top(5, 200) == []
+        assert w.counts == {}
+
+    def test_tag_timeline(self):
+        u = User(nickname='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        db.session.add(Post(body='old #python post', user=u))
+        db.session.commit()
+        assert Tag.query.filter_by(name='#python').count() == 1
+        self.app.get('/login/john')
+        assert trending.top('hour') == [('#python', 1)]
+        self.app.post('/index', data={'post': 'hello #Python @john'})
+        assert trending.top('hour') == [('#python', 2), ('@john', 1)]
+        assert trending.top('day', 1) == [('#python', 2)]
+        rv = self.app.get('/tag/python')
+        assert rv.status_code == 200
+        assert b'hello #Python @john' in rv.data
+        assert b'old #python post' in rv.data
+        rv = self.app.get('/tag/@john')
+        assert b'hello #Python @john' in rv.data
+        assert b'old #python post' not in rv.data
+        assert self.app.get('/trending').status_code == 200
+
+    def test_tag_backfill(self):
+        u = User(nickname='john', email='john@example.com')
+        db.session.add(u)
+        db.session.add(Post(body='#old post', user=u))
+        db.session.add(Post(body='no tags', user=u))
+        db.session.commit()
+        Tag.query.delete()
+        db.session.commit()
+        assert Tag.backfill(batch_size=1) == 2
+        assert [tag.name for tag in Tag.query.all()] == ['#old']
+        assert Tag.backfill() == 1
+        assert Tag.query.count() == 1
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file